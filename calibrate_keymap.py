@@ -12,10 +12,14 @@ import time
 import glob
 import os
 import re
+import select
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import serial
     from serial.serialutil import SerialException
+    from serial.tools import list_ports
 except ImportError:
     print("Please install first: pip install pyserial")
     sys.exit(1)
@@ -23,26 +27,39 @@ except ImportError:
 CIRCUITPY_PATH = "/Volumes/CIRCUITPY"
 KEY_MAP_FILENAME = ".key_map"
 EXPECTED_DEVICE_ID = "PICO-KEYPAD-V1"
+USBMODEM_RE = re.compile(r'usbmodem(\d{5,})')
+# USB vendor IDs a CircuitPython Pico enumerates with (Adafruit, Raspberry Pi)
+PICO_USB_VIDS = (0x239A, 0x2E8A)
+
+# macOS receive latency ioctl: IOSSDATALAT = _IOW('T', 0, unsigned long)
+# from <IOKit/serial/ioss.h>
+IOSSDATALAT = 0x80085400
+
+
+def set_low_latency(ser):
+    """Ask the OS to hand received serial data over immediately (best effort)."""
+    try:
+        if sys.platform.startswith("linux"):
+            ser.set_low_latency_mode(True)
+        elif sys.platform == "darwin":
+            import fcntl
+            import struct
+            fcntl.ioctl(ser.fileno(), IOSSDATALAT, struct.pack("L", 1))
+    except (AttributeError, NotImplementedError, ValueError, OSError):
+        pass  # Not supported by this driver, keep the default latency
 
 
 def ping_device(port, timeout=1.0):
     """Send PING command and check if device responds with correct ID."""
     try:
         ser = serial.Serial(port, 115200, timeout=timeout)
-        time.sleep(0.1)
+        set_low_latency(ser)
         ser.reset_input_buffer()
         ser.write(b"PING\n")
         ser.flush()
 
-        start = time.time()
-        buf = b""
-        while time.time() - start < timeout:
-            if ser.in_waiting > 0:
-                buf += ser.read(ser.in_waiting)
-                if b"\n" in buf:
-                    break
-            time.sleep(0.05)
-
+        # Returns as soon as the reply line is complete (or on timeout)
+        buf = ser.read_until(b"\n", 64)
         ser.close()
 
         response = buf.decode("utf-8", errors="ignore").strip()
@@ -53,8 +70,51 @@ def ping_device(port, timeout=1.0):
         return False
 
 
+def ping_first(candidates):
+    """Ping all candidates in parallel and return the first keypad port, or None."""
+    # The device replies within milliseconds, so a short timeout is enough.
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        futures = {executor.submit(ping_device, port, 0.5): port for port in candidates}
+        for future in as_completed(futures):
+            port = futures[future]
+            try:
+                if future.result():
+                    print(f"[INFO] Found keypad on {port}")
+                    return port
+                else:
+                    print(f"[INFO] {port} is not the keypad")
+            except SerialException as e:
+                print(f"[WARN] Port {port} not usable: {e}")
+    finally:
+        # Don't wait for the remaining pings, they close their port themselves
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+
+def find_pico_port_by_usb():
+    """Look up the keypad's data port by USB vendor ID, without opening every port."""
+    picos = [p for p in list_ports.comports() if p.vid in PICO_USB_VIDS]
+    if not picos:
+        return None
+
+    # CircuitPython names the usb_cdc.data interface "... CDC2"
+    data_ports = [p for p in picos if p.interface and "CDC2" in p.interface]
+    if len(data_ports) == 1:
+        print(f"[INFO] Found keypad data port via USB: {data_ports[0].device}")
+        return data_ports[0].device
+
+    # Ambiguous (several boards, or no interface names): ping only these
+    return ping_first([p.device for p in data_ports or picos])
+
+
 def find_pico_port():
     """Find the Pico keypad serial port."""
+    port = find_pico_port_by_usb()
+    if port:
+        return port
+
+    # Fall back to probing the usbmodem device nodes
     candidates = sorted(
         glob.glob("/dev/tty.usbmodem*") + glob.glob("/dev/tty.usbserial*")
     )
@@ -64,58 +124,49 @@ def find_pico_port():
     print(f"[INFO] Found ports: {candidates}")
 
     # Group by common prefix (Pico dual CDC pattern)
-    from collections import defaultdict
-    groups = defaultdict(list)
+    prefixes = []
     for port in candidates:
-        match = re.search(r'usbmodem(\d{5,})', port)
-        if match:
-            prefix = match.group(1)[:5]
-            groups[prefix].append(port)
-        else:
-            groups['other'].append(port)
+        match = USBMODEM_RE.search(port)
+        prefixes.append(match.group(1)[:5] if match else "other")
+    counts = Counter(prefixes)
 
     # Prefer groups with exactly 2 ports (Pico dual CDC pattern)
-    pico_candidates = []
-    for prefix, ports in groups.items():
-        if len(ports) == 2:
-            pico_candidates.extend(ports)
+    pico_candidates = [port for port, prefix in zip(candidates, prefixes) if counts[prefix] == 2]
 
     if pico_candidates:
         candidates = sorted(pico_candidates)
 
-    # Try to identify the correct device using PING
-    for port in reversed(candidates):
-        try:
-            print(f"[INFO] Pinging {port}...")
-            if ping_device(port):
-                print(f"[INFO] Found keypad on {port}")
-                return port
-            else:
-                print(f"[INFO] {port} is not the keypad")
-        except SerialException as e:
-            print(f"[WARN] Port {port} not usable: {e}")
+    # Ping all candidates in parallel and take the first one that answers
+    port = ping_first(candidates)
+    if port:
+        return port
 
     raise RuntimeError(f"No Pico keypad found. Make sure the device responds to PING.")
 
 
 def wait_for_button(ser, timeout=30.0):
     """Wait for a button press and return the raw button number."""
-    start = time.time()
+    deadline = time.monotonic() + timeout
     buf = b""
 
-    while time.time() - start < timeout:
-        if ser.in_waiting > 0:
-            buf += ser.read(ser.in_waiting)
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                line = line.decode("utf-8", errors="ignore").strip()
-                if line.startswith("BTN:"):
-                    parts = line.split(":")
-                    # Skip long press events
-                    if len(parts) > 2 and parts[2] == "LONG":
-                        continue
-                    return int(parts[1])
-        time.sleep(0.01)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Block in the kernel until data arrives instead of polling
+        ready, _, _ = select.select([ser], [], [], remaining)
+        if not ready:
+            break
+        buf += ser.read(ser.in_waiting or 1)
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            line = line.decode("utf-8", errors="ignore").strip()
+            if line.startswith("BTN:"):
+                parts = line.split(":")
+                # Skip long press events
+                if len(parts) > 2 and parts[2] == "LONG":
+                    continue
+                return int(parts[1])
 
     return None
 
@@ -149,17 +200,14 @@ def load_existing_key_map():
         return None
 
     try:
-        key_map = {}
-        with open(key_map_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split(":")
-                if len(parts) == 2:
-                    raw_btn = int(parts[0])
-                    logical_btn = int(parts[1])
-                    key_map[raw_btn] = logical_btn
+        with open(key_map_path, "rb") as f:
+            data = f.read()
+        # One "raw:logical" pair per line, "#" starts a comment line
+        key_map = {
+            int(raw): int(logical)
+            for raw, sep, logical in (line.strip().partition(b":") for line in data.split(b"\n"))
+            if sep and b":" not in logical and not raw.startswith(b"#")
+        }
         return key_map
     except Exception as e:
         print(f"[WARN] Error reading existing key map: {e}")
@@ -193,9 +241,12 @@ def save_key_map(key_map):
 
 def print_key_map_grid(key_map):
     """Print the key map as a 3x3 grid showing raw -> logical mapping."""
-    print("\n┌─────────────────────────────────────┐")
-    print("│         KEY MAP (Raw → Logical)     │")
-    print("├───────────┬───────────┬─────────────┤")
+    rows = [
+        "",
+        "┌─────────────────────────────────────┐",
+        "│         KEY MAP (Raw → Logical)     │",
+        "├───────────┬───────────┬─────────────┤",
+    ]
 
     # Reverse map: logical -> raw
     logical_to_raw = {v: k for k, v in key_map.items()}
@@ -206,11 +257,12 @@ def print_key_map_grid(key_map):
             logical = row * 3 + col + 1
             raw = logical_to_raw.get(logical, "?")
             cells.append(f"  {raw} → {logical}  ")
-        print(f"│{cells[0]}│{cells[1]}│{cells[2]}│")
+        rows.append(f"│{cells[0]}│{cells[1]}│{cells[2]}│")
         if row < 2:
-            print("├───────────┼───────────┼─────────────┤")
+            rows.append("├───────────┼───────────┼─────────────┤")
 
-    print("└───────────┴───────────┴─────────────┘")
+    rows.append("└───────────┴───────────┴─────────────┘")
+    sys.stdout.write("\n".join(rows) + "\n")
 
 
 def calibrate():
@@ -279,6 +331,7 @@ def calibrate():
 
     print(f"\n[INFO] Connecting to {port}...")
     ser = serial.Serial(port, 115200, timeout=0.1)
+    set_low_latency(ser)
     time.sleep(0.5)
     ser.reset_input_buffer()
 
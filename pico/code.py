@@ -1,7 +1,9 @@
+import array
 import time
 import board
-import digitalio
+import keypad
 import neopixel
+import supervisor
 import usb_cdc
 
 # -------- BUTTON REMAP --------
@@ -11,24 +13,21 @@ import usb_cdc
 # regardless of how the buttons are wired.
 BUTTON_REMAP = {}
 try:
-    with open("/.key_map", "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            parts = line.split(":")
-            if len(parts) == 2:
-                raw_btn = int(parts[0])
-                logical_btn = int(parts[1])
-                BUTTON_REMAP[raw_btn] = logical_btn
+    with open("/.key_map", "rb") as f:
+        data = f.read()
+    for line in data.split(b"\n"):
+        line = line.strip()
+        if not line or line.startswith(b"#"):
+            continue
+        parts = line.split(b":")
+        if len(parts) == 2:
+            BUTTON_REMAP[int(parts[0])] = int(parts[1])
+    del data
 except OSError:
     pass  # File doesn't exist, no remap needed
 except (ValueError, IndexError):
     pass  # Invalid file format, skip
 
-def remap_button(btn_num):
-    return BUTTON_REMAP.get(btn_num, btn_num)
-
 # -------- PIN CONFIG --------
 BUTTON_PINS = [
     board.GP11,  # Button 1
@@ -42,6 +41,9 @@ BUTTON_PINS = [
     board.GP10,  # Button 9
 ]
 
+# Logical button number for each raw button index (the remap is fixed at boot)
+LOGICAL_BUTTONS = tuple(BUTTON_REMAP.get(i + 1, i + 1) for i in range(len(BUTTON_PINS)))
+
 NEOPIXEL_PIN = board.GP22
 NUM_PIXELS = 8
 BRIGHTNESS = 0.2
@@ -50,74 +52,107 @@ console = usb_cdc.console
 evt_ser = usb_cdc.data if usb_cdc.data is not None else usb_cdc.console
 
 # -------- BUTTONS --------
-buttons = []
-for idx, pin in enumerate(BUTTON_PINS, start=1):
-    btn = digitalio.DigitalInOut(pin)
-    # Button at 3.3V -> internal PULL_DOWN
-    btn.switch_to_input(pull=digitalio.Pull.DOWN)
-    buttons.append(btn)
-
-# Initial state: all not pressed
-last_states = [False] * len(buttons)
-# Track when each button was pressed (for long-press detection)
-press_times = [0.0] * len(buttons)
-# Track if we already sent a LONG event for this press
-long_sent = [False] * len(buttons)
-LONG_PRESS_DURATION = 5.0  # seconds
+# keypad.Keys scans and debounces the pins in the background and queues
+# press/release events, so the main loop only has to drain the queue.
+# Button at 3.3V -> pressed reads True, internal PULL_DOWN
+keys = keypad.Keys(
+    BUTTON_PINS,
+    value_when_pressed=True,
+    pull=True,
+    interval=0.005,
+    max_events=32,
+)
+NUM_BUTTONS = len(BUTTON_PINS)
+
+# BIT_TO_IDX maps a single-bit mask back to its button index.
+BIT_TO_IDX = {1 << i: i for i in range(NUM_BUTTONS)}
+# Track when each button was pressed (ticks_ms, for long-press detection),
+# stored unboxed as 32-bit unsigned values
+press_times = array.array("L", [0] * NUM_BUTTONS)
+LONG_PRESS_MS = 5000
+# supervisor.ticks_ms() wraps around at 2**29
+TICKS_MASK = (1 << 29) - 1
+
+# Event messages per raw button with the remap already applied, encoded once
+# so a press sends ready-made bytes
+SHORT_MSGS = tuple(f"BTN:{n}\n".encode() for n in LOGICAL_BUTTONS)
+LONG_MSGS = tuple(f"BTN:{n}:LONG\n".encode() for n in LOGICAL_BUTTONS)
 
 # -------- NEOPIXEL --------
 pixels = neopixel.NeoPixel(
     NEOPIXEL_PIN,
     NUM_PIXELS,
     brightness=BRIGHTNESS,
-    auto_write=True,
+    auto_write=False,
 )
 pixels.fill((0, 0, 0))
+pixels.show()
 
-# small startup effect
-for i in range(NUM_PIXELS):
-    pixels[i] = (0, 0, 40)
-    time.sleep(0.05)
-pixels.fill((0, 0, 0))
+# Small startup effect. It is stepped from run() instead of blocking here,
+# so the board answers the host right away while the sweep is still going.
+SWEEP_STEP_MS = 20
+
+# The strip is refreshed at most once per main loop pass: writes only update
+# the pixel buffer and set this flag, run() calls pixels.show() if it is set.
+pixels_dirty = False
 
-def send_event(msg: str):
+def send_event(msg: bytes):
+    """Send a newline-terminated message (already encoded) to the host"""
     if evt_ser is not None:
         try:
             # Always try to send, even if connected=False
             # (connected can be unreliable with pyserial connections)
-            evt_ser.write((msg + "\n").encode("utf-8"))
-            evt_ser.flush()  # Ensure data is sent immediately
+            # Not flushed here: run() flushes once per pass after all
+            # events and replies of that pass have been written
+            evt_ser.write(msg)
         except Exception as e:
             pass
     else:
         pass
 
 def set_pixel(i, r, g, b):
+    global pixels_dirty
     if 0 <= i < NUM_PIXELS:
         pixels[i] = (r, g, b)
+        pixels_dirty = True
+
+def fill_pixels(rgb):
+    global pixels_dirty
+    pixels.fill(rgb)
+    pixels_dirty = True
 
 # Animation state
 animating = False
 anim_color = (0, 0, 0)
 anim_led = 0
 anim_start_time = 0
+last_anim_rgb = None  # Last frame written, to skip unchanged frames
+last_anim_ms = 0  # ticks_ms of the last computed frame
+ANIM_FRAME_MS = 30  # ~33 fps is plenty for a slow pulse
 
 def start_pulse_animation(led_idx, r, g, b):
-    global animating, anim_color, anim_led, anim_start_time
+    global animating, anim_color, anim_led, anim_start_time, last_anim_rgb
     animating = True
     anim_color = (r, g, b)
     anim_led = led_idx
     anim_start_time = time.monotonic()
+    last_anim_rgb = None
 
 def stop_animation():
     global animating
     animating = False
 
 def update_animation():
-    global animating, anim_color, anim_led, anim_start_time
+    global last_anim_rgb, last_anim_ms
     if not animating:
         return
-    
+
+    # Only compute a new frame every ANIM_FRAME_MS
+    now_ms = supervisor.ticks_ms()
+    if (now_ms - last_anim_ms) & TICKS_MASK < ANIM_FRAME_MS:
+        return
+    last_anim_ms = now_ms
+
     # Pulse animation: fade in and out
     elapsed = time.monotonic() - anim_start_time
     # 2 second cycle (1 second fade in, 1 second fade out)
@@ -129,95 +164,231 @@ def update_animation():
         # Fade out
         brightness = 2.0 - cycle
     
-    r = int(anim_color[0] * brightness)
-    g = int(anim_color[1] * brightness)
-    b = int(anim_color[2] * brightness)
-    set_pixel(anim_led, r, g, b)
+    rgb = (
+        int(anim_color[0] * brightness),
+        int(anim_color[1] * brightness),
+        int(anim_color[2] * brightness),
+    )
+    if rgb == last_anim_rgb:
+        return  # Same frame as last time, nothing to refresh
+    last_anim_rgb = rgb
+    set_pixel(anim_led, *rgb)
 
 DEVICE_ID = "PICO-KEYPAD-V1"
+PONG_MSG = f"PONG:{DEVICE_ID}\n".encode()
 
-def parse_host_command(line: str):
+def parse_rgb(bs):
+    """Parse b"r,g,b" into an (r, g, b) tuple, or None if it is malformed"""
+    parts = bs.split(b",")
+    if len(parts) != 3:
+        return None
+    r, g, b = parts
+    if not (r.isdigit() and g.isdigit() and b.isdigit()):
+        return None
+    rgb = (int(r), int(g), int(b))
+    if max(rgb) > 255:
+        return None
+    return rgb
+
+def parse_host_command(line: bytes):
+    # Commands are plain ASCII, so they are matched on the raw bytes and
+    # anything unknown is dropped before any decoding or splitting happens.
+    # Arguments are validated up front instead of relying on exceptions.
     line = line.strip()
-    parts = line.split(":")
 
     # Handle PING command for device identification
-    if parts[0] == "PING":
-        send_event(f"PONG:{DEVICE_ID}")
+    if line.startswith(b"PING"):
+        send_event(PONG_MSG)
         return
 
-    if not parts or parts[0] != "LED":
+    if not line.startswith(b"LED:") or len(line) < 5:
         return
 
-    if parts[1] == "ALL":
-        try:
-            r, g, b = map(int, parts[2].split(","))
-            pixels.fill((r, g, b))
+    # Dispatch on the first byte of the second segment
+    sel = line[4]
+    if sel == 0x41:  # "A"
+        if line.startswith(b"ALL:", 4):
+            # LED:ALL:r,g,b
+            rgb = parse_rgb(line[8:])
+            if rgb is None:
+                return
+            fill_pixels(rgb)
             stop_animation()  # Stop animation when ALL is used
-        except Exception as e:
-            pass
-    elif parts[1] == "ANIM":
-        # LED:ANIM:led_idx:r,g,b - Start pulse animation on specific LED
-        try:
-            led_idx = int(parts[2])
-            r, g, b = map(int, parts[3].split(","))
-            start_pulse_animation(led_idx, r, g, b)
-        except Exception as e:
-            pass
-    elif parts[1] == "STOP":
-        # LED:STOP - Stop any running animation
-        stop_animation()
-    else:
-        try:
-            idx = int(parts[1])
-            r, g, b = map(int, parts[2].split(","))
-            set_pixel(idx, r, g, b)
-            # Stop animation if we're setting the animated LED
+        elif line.startswith(b"ANIM:", 4):
+            # LED:ANIM:led_idx:r,g,b - Start pulse animation on specific LED
+            p = line.find(b":", 9)
+            if p == -1:
+                return
+            idx_bs = line[9:p]
+            rgb = parse_rgb(line[p + 1:])
+            if rgb is None or not idx_bs.isdigit():
+                return
+            start_pulse_animation(int(idx_bs), *rgb)
+    elif sel == 0x4D:  # "M"
+        # LED:MANY:idx,r,g,b;idx,r,g,b;... - several LEDs in one line
+        if not line.startswith(b"MANY:", 4):
+            return
+        for spec in line[9:].split(b";"):
+            p = spec.find(b",")
+            if p == -1:
+                continue
+            idx_bs = spec[:p]
+            rgb = parse_rgb(spec[p + 1:])
+            if rgb is None or not idx_bs.isdigit():
+                continue
+            idx = int(idx_bs)
+            set_pixel(idx, *rgb)
             if animating and anim_led == idx:
                 stop_animation()
-        except Exception as e:
-            pass
+    elif sel == 0x53:  # "S"
+        # LED:STOP - Stop any running animation
+        if line.startswith(b"STOP", 4):
+            stop_animation()
+    elif 0x30 <= sel <= 0x39:  # digit
+        # LED:idx:r,g,b
+        p = line.find(b":", 4)
+        if p == -1:
+            return
+        idx_bs = line[4:p]
+        rgb = parse_rgb(line[p + 1:])
+        if rgb is None or not idx_bs.isdigit():
+            return
+        idx = int(idx_bs)
+        set_pixel(idx, *rgb)
+        # Stop animation if we're setting the animated LED
+        if animating and anim_led == idx:
+            stop_animation()
+
+def run():
+    """Main loop. Everything the loop touches is bound to a local name first,
+    so each pass uses fast local lookups instead of global/attribute ones."""
+    global pixels_dirty
+    mono_ms = supervisor.ticks_ms
+    sleep = time.sleep
+    events = keys.events
+    get_event = events.get_into
+    send = send_event
+    short_msgs = SHORT_MSGS
+    long_msgs = LONG_MSGS
+    update_anim = update_animation
+    parse = parse_host_command
+    bit_to_idx = BIT_TO_IDX
+    pt = press_times
+    ser = evt_ser
+    show = pixels.show
+
+    event = keypad.Event()
+    # Bit i is set while button i+1 is held down
+    held_bits = 0
+    # Bit i is set once a LONG event was sent for the current press
+    long_sent_bits = 0
+    # Keys held when an overflow reset the scanner. Their re-reported
+    # presses only restore held_bits, the host already has the BTN.
+    resync_bits = 0
+    buf = b""
+    # Startup sweep: steps 0..NUM_PIXELS-1 light one LED each, the last step
+    # clears the strip again. Anything past NUM_PIXELS means done.
+    sweep_step = 0
+    sweep_last_ms = mono_ms()
 
-buf = b""
-
-while True:
-    # 1. Query buttons
-    now = time.monotonic()
-    for i, btn in enumerate(buttons):
-        cur = btn.value  # False = not pressed, True = pressed (due to Pull.DOWN + 3V3)
-        if cur != last_states[i]:
-            # "Click" = edge from False -> True
-            if (not last_states[i]) and cur:
-                send_event(f"BTN:{remap_button(i+1)}")
-                press_times[i] = now
-                long_sent[i] = False
+    while True:
+        # Set when this pass handled input, so the next one runs without delay
+        busy = False
+        # Button events of this pass, sent to the host in one write
+        out = b""
+
+        # 1. Drain button events
+        while get_event(event):
+            busy = True
+            i = event.key_number
+            b = 1 << i
+            # "Click" = key went down
+            if event.pressed:
+                held_bits |= b
+                if resync_bits & b:
+                    continue  # Keep its press time and LONG state
+                out += short_msgs[i]
+                pt[i] = event.timestamp
             # Button released - reset
-            elif last_states[i] and (not cur):
-                press_times[i] = 0.0
-                long_sent[i] = False
-        # Check for long press (button still held)
-        elif cur and press_times[i] > 0 and not long_sent[i]:
-            if now - press_times[i] >= LONG_PRESS_DURATION:
-                send_event(f"BTN:{remap_button(i+1)}:LONG")
-                long_sent[i] = True
-        last_states[i] = cur
-
-    # 2. Update animations
-    update_animation()
-
-    # 3. Read host commands
-    if evt_ser is not None:
-        try:
-            if evt_ser.in_waiting > 0:
-                incoming = evt_ser.read(evt_ser.in_waiting)
-                if incoming:
-                    buf += incoming
-                    while b"\n" in buf:
-                        line, buf = buf.split(b"\n", 1)
-                        try:
-                            parse_host_command(line.decode("utf-8"))
-                        except Exception as e:
-                            pass
-        except (AttributeError, OSError) as e:
-            pass
+            else:
+                held_bits &= ~b
+            long_sent_bits &= ~b
+        if busy:
+            # Re-reports after a reset come in one batch, later presses are new
+            resync_bits = 0
+            if events.overflowed:
+                # Events were dropped, so held_bits can't be trusted anymore.
+                # Start over: reset() re-reports keys that are still held.
+                events.clear()
+                keys.reset()
+                resync_bits = held_bits
+                held_bits = 0
+        # Check for long press (held buttons that have not reported LONG yet)
+        pending = held_bits & ~long_sent_bits
+        if pending:
+            now_ms = mono_ms()
+            while pending:
+                b = pending & -pending
+                pending ^= b
+                i = bit_to_idx[b]
+                if (now_ms - pt[i]) & TICKS_MASK >= LONG_PRESS_MS:
+                    out += long_msgs[i]
+                    long_sent_bits |= b
+        if out:
+            send(out)
+            busy = True  # LONG events can come from an idle pass, flush them too
+
+        # 2. Update animations (skip the call entirely while idle)
+        if animating:
+            update_anim()
+
+        # 3. Read host commands
+        if ser is not None:
+            try:
+                waiting = ser.in_waiting
+                if waiting > 0:
+                    incoming = ser.read(waiting)
+                    if incoming:
+                        busy = True
+                        if sweep_step <= NUM_PIXELS:
+                            # Host takes over the LEDs: end the sweep early
+                            fill_pixels((0, 0, 0))
+                            sweep_step = NUM_PIXELS + 1
+                        buf += incoming
+                        while b"\n" in buf:
+                            line, buf = buf.split(b"\n", 1)
+                            try:
+                                parse(line)
+                            except Exception as e:
+                                pass
+            except (AttributeError, OSError) as e:
+                pass
+
+        # 4. Ship everything written in this pass (events, PONG) at once
+        if busy and ser is not None:
+            try:
+                ser.flush()
+            except Exception as e:
+                pass
+
+        # 5. Advance the startup sweep
+        if sweep_step <= NUM_PIXELS:
+            now_ms = mono_ms()
+            if (now_ms - sweep_last_ms) & TICKS_MASK >= SWEEP_STEP_MS:
+                sweep_last_ms = now_ms
+                if sweep_step < NUM_PIXELS:
+                    set_pixel(sweep_step, 0, 0, 40)
+                else:
+                    fill_pixels((0, 0, 0))
+                sweep_step += 1
+
+        # 6. Push pixel changes from this pass to the strip in one refresh
+        if pixels_dirty:
+            show()
+            pixels_dirty = False
+
+        # Button scanning happens in the background: right after real work
+        # only yield, otherwise idle briefly before polling again
+        sleep(0 if busy else 0.002)
 
-    time.sleep(0.01)
+run()
@@ -4,12 +4,18 @@ import time
 import glob
 import csv
 import os
-import subprocess
+import shutil
+import signal
 import re
-from datetime import datetime
+import selectors
+import functools
+import itertools
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
 try:
     import serial  # pip install pyserial
     from serial.serialutil import SerialException
+    from serial.tools import list_ports
 except ImportError:
     print("Please install first: pip install pyserial")
     sys.exit(1)
@@ -30,6 +36,7 @@ except ImportError:
 #
 # Keymap structure: layer -> button -> config dict
 # Each config can have: "action" (required), "label" (for projects), "color" (RGB tuple)
+# Project entries also get "_led_bytes" at import, see precompute_led_bytes()
 KEYMAP = {
     0: {  # Layer 0 (default)
         1: {"action": "tracking_toggle"},
@@ -96,7 +103,7 @@ def load_project_config():
         for layer, button, project_num in project_mapping:
             project_key = str(project_num)
             if project_key in projects:
-                new_label = projects[project_key]
+                new_label = str(projects[project_key])  # YAML may give e.g. an int
                 if layer in KEYMAP and button in KEYMAP[layer]:
                     if KEYMAP[layer][button].get("action") == "project":
                         KEYMAP[layer][button]["label"] = new_label
@@ -136,11 +143,47 @@ def is_circuitpy_mounted():
 def files_are_identical(path1, path2):
     """Compare two files by content"""
     try:
+        # Different sizes can't match, no need to read anything
+        if os.path.getsize(path1) != os.path.getsize(path2):
+            return False
         with open(path1, "rb") as f1, open(path2, "rb") as f2:
-            return f1.read() == f2.read()
+            while True:
+                chunk1 = f1.read(65536)
+                if chunk1 != f2.read(65536):
+                    return False
+                if not chunk1:
+                    return True
     except (IOError, OSError):
         return False
 
+def get_firmware_sig_path():
+    """Get path to the signature of the last verified firmware sync"""
+    return os.path.join(get_script_dir(), "pico", ".pico_firmware.sig")
+
+def firmware_signature(local_code, pico_code):
+    """mtime + size of both firmware files, as a single comparable string"""
+    st_local = os.stat(local_code)
+    st_pico = os.stat(pico_code)
+    return (f"{st_local.st_mtime_ns} {st_local.st_size} "
+            f"{st_pico.st_mtime_ns} {st_pico.st_size}")
+
+def read_firmware_sig():
+    try:
+        with open(get_firmware_sig_path()) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def write_firmware_sig(local_code, pico_code):
+    """Remember that both files are identical, so the next start can skip
+    reading the Pico's code.py as long as neither file has been touched"""
+    try:
+        sig = firmware_signature(local_code, pico_code)
+        with open(get_firmware_sig_path(), "w") as f:
+            f.write(sig + "\n")
+    except OSError:
+        pass  # Only an optimization, compare by content next time
+
 def check_and_update_pico_firmware():
     """
     Check if Pico firmware needs updating and copy if necessary.
@@ -162,7 +205,12 @@ def check_and_update_pico_firmware():
     # Check if code.py exists on Pico
     if not os.path.exists(pico_code):
         print("[UPDATE] No code.py on Pico, copying firmware...")
+    elif firmware_signature(local_code, pico_code) == read_firmware_sig():
+        # Neither file changed since they were last found identical
+        print("[UPDATE] Pico firmware is up to date")
+        return False
     elif files_are_identical(local_code, pico_code):
+        write_firmware_sig(local_code, pico_code)
         print("[UPDATE] Pico firmware is up to date")
         return False
     else:
@@ -170,8 +218,8 @@ def check_and_update_pico_firmware():
 
     # Copy the file
     try:
-        import shutil
         shutil.copy2(local_code, pico_code)
+        write_firmware_sig(local_code, pico_code)
         print("[UPDATE] Firmware copied successfully!")
         print("[UPDATE] Pico will restart automatically...")
         # Give the filesystem time to sync and Pico to restart
@@ -183,26 +231,38 @@ def check_and_update_pico_firmware():
 
 # ----- SERIAL HELPER FUNCTIONS -----
 EXPECTED_DEVICE_ID = "PICO-KEYPAD-V1"
+# Button event from the Pico: BTN:<n> or BTN:<n>:LONG
+BTN_RE = re.compile(rb"BTN:(\d+)(:LONG)?")
+# Serial number part of a macOS usbmodem device name
+USBMODEM_RE = re.compile(r"usbmodem(\d{5,})")
+
+# macOS receive latency ioctl: IOSSDATALAT = _IOW('T', 0, unsigned long)
+# from <IOKit/serial/ioss.h>
+IOSSDATALAT = 0x80085400
+
+def set_low_latency(ser):
+    """Ask the OS to hand received serial data over immediately (best effort)"""
+    try:
+        if sys.platform.startswith("linux"):
+            ser.set_low_latency_mode(True)
+        elif sys.platform == "darwin":
+            import fcntl
+            import struct
+            fcntl.ioctl(ser.fileno(), IOSSDATALAT, struct.pack("L", 1))
+    except (AttributeError, NotImplementedError, ValueError, OSError):
+        pass  # Not supported by this driver, keep the default latency
 
 def ping_device(port, timeout=1.0):
     """Send PING command and check if device responds with correct ID."""
     try:
         ser = serial.Serial(port, 115200, timeout=timeout)
-        time.sleep(0.1)  # Give device time to initialize
+        set_low_latency(ser)
         ser.reset_input_buffer()  # Clear any pending data
         ser.write(b"PING\n")
         ser.flush()
 
-        # Wait for response
-        start = time.time()
-        buf = b""
-        while time.time() - start < timeout:
-            if ser.in_waiting > 0:
-                buf += ser.read(ser.in_waiting)
-                if b"\n" in buf:
-                    break
-            time.sleep(0.05)
-
+        # Wait for response - returns as soon as the line is complete
+        buf = ser.read_until(b"\n", 64)
         ser.close()
 
         # Check response
@@ -214,10 +274,93 @@ def ping_device(port, timeout=1.0):
         return False
 
 
+def handshake(ser, timeout=2.0):
+    """PING the keypad until it answers, returns True once the link is up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ser.write(b"PING\n")
+        ser.flush()
+        # Blocks for at most the port timeout
+        if ser.read_until(b"\n", 64).startswith(b"PONG:"):
+            return True
+    return False
+
+
+# USB vendor IDs a CircuitPython Pico enumerates with (Adafruit, Raspberry Pi)
+PICO_USB_VIDS = (0x239A, 0x2E8A)
+
+def find_pico_port_by_usb(port_filter=None):
+    """Look up the keypad's data port by USB vendor ID, without opening any
+    port. Returns None if the OS doesn't report a matching device"""
+    picos = [p for p in list_ports.comports() if p.vid in PICO_USB_VIDS]
+    if port_filter:
+        picos = [p for p in picos if port_filter in p.device] or picos
+    if not picos:
+        return None
+
+    # CircuitPython names the usb_cdc.data interface "... CDC2"
+    data_ports = [p for p in picos if p.interface and "CDC2" in p.interface]
+    if len(data_ports) == 1:
+        print(f"[INFO] Found keypad data port via USB: {data_ports[0].device}")
+        return data_ports[0].device
+
+    # Ambiguous (several boards, or no interface names): ping those only,
+    # data port last in USB location order so it's tried first
+    candidates = sorted(data_ports or picos, key=lambda p: (p.location or "", p.device))
+    for p in reversed(candidates):
+        print(f"[INFO] Pinging {p.device}...")
+        try:
+            if ping_device(p.device):
+                print(f"[INFO] Found keypad on {p.device}")
+                return p.device
+        except SerialException as e:
+            print(f"[WARN] Port {p.device} not usable: {e}")
+    return None
+
+def _usb_serial_nodes():
+    """Identity of each usbmodem/usbserial device node currently in /dev,
+    as a {name: (inode, ctime)} dict. A replugged device often gets the
+    same name back, but always a freshly created node."""
+    try:
+        names = os.listdir("/dev")
+    except OSError:
+        return {}
+    nodes = {}
+    for n in names:
+        if n.startswith(("tty.usbmodem", "tty.usbserial")):
+            try:
+                st = os.stat("/dev/" + n)
+            except OSError:
+                continue  # Vanished between listdir and stat
+            nodes[n] = (st.st_ino, st.st_ctime_ns)
+    return nodes
+
+def wait_for_port(timeout):
+    """Wait up to timeout seconds for a usbmodem/usbserial device node to be
+    created, checking every 100 ms instead of sleeping the whole time.
+    Nodes that already existed unchanged on entry don't count, so a stale
+    or unrelated port still waits the full delay, while a replugged port
+    that reuses a stale node's name ends the wait"""
+    deadline = time.monotonic() + timeout
+    known = _usb_serial_nodes()
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(0.1, remaining))
+        for name, ident in _usb_serial_nodes().items():
+            if known.get(name) != ident:
+                return True
+
 def find_pico_port(port_filter=None):
-    candidates = sorted(
-        glob.glob("/dev/tty.usbmodem*") + glob.glob("/dev/tty.usbserial*")
-    )
+    port = find_pico_port_by_usb(port_filter)
+    if port:
+        return port
+
+    # Fall back to probing the usbmodem device nodes
+    candidates = sorted(itertools.chain(
+        glob.iglob("/dev/tty.usbmodem*"), glob.iglob("/dev/tty.usbserial*")
+    ))
     if not candidates:
         raise RuntimeError("No Pico found (/dev/tty.usbmodem*).")
 
@@ -232,22 +375,15 @@ def find_pico_port(port_filter=None):
 
     # Pico with dual CDC creates two ports with similar prefixes.
     # Group by common prefix and prefer groups with 2+ ports.
-    from collections import defaultdict
-    groups = defaultdict(list)
+    prefixes = []
     for port in candidates:
         # Extract prefix: /dev/tty.usbmodem20224 -> 20224 (first 5 digits after usbmodem)
-        match = re.search(r'usbmodem(\d{5,})', port)
-        if match:
-            prefix = match.group(1)[:5]  # First 5 digits as group key
-            groups[prefix].append(port)
-        else:
-            groups['other'].append(port)
+        match = USBMODEM_RE.search(port)
+        prefixes.append(match.group(1)[:5] if match else "other")
+    counts = Counter(prefixes)
 
     # Prefer groups with exactly 2 ports (Pico dual CDC pattern)
-    pico_candidates = []
-    for prefix, ports in groups.items():
-        if len(ports) == 2:
-            pico_candidates.extend(ports)
+    pico_candidates = [port for port, prefix in zip(candidates, prefixes) if counts[prefix] == 2]
 
     if pico_candidates:
         print(f"[INFO] Detected Pico dual CDC ports: {pico_candidates}")
@@ -269,20 +405,52 @@ def find_pico_port(port_filter=None):
     raise RuntimeError(f"No Pico keypad found. Make sure the device responds to PING with PONG:{EXPECTED_DEVICE_ID}")
 
 
-def send_led_all(ser, r, g, b):
-    ser.write(f"LED:ALL:{r},{g},{b}\n".encode("utf-8"))
-
-def send_led(ser, idx, r, g, b):
-    """Set a single LED without affecting others"""
-    ser.write(f"LED:{idx}:{r},{g},{b}\n".encode("utf-8"))
+@functools.lru_cache(maxsize=64)
+def led_cmd(idx, r, g, b):
+    """Encoded LED command for one LED, or for all LEDs if idx is None.
+    Colors come from a small fixed palette, so the bytes are cached."""
+    # Formatted as bytes directly, no str + encode() round trip
+    if idx is None:
+        return b"LED:ALL:%d,%d,%d\n" % (r, g, b)
+    return b"LED:%d:%d,%d,%d\n" % (idx, r, g, b)
+
+@functools.lru_cache(maxsize=64)
+def led_many_cmd(*updates):
+    """Encoded LED:MANY command setting several LEDs in one line, from
+    (idx, r, g, b) tuples. The Pico applies them with a single refresh."""
+    return b"LED:MANY:" + b";".join(b"%d,%d,%d,%d" % u for u in updates) + b"\n"
+
+# Every LED command main() sends for fixed states, built once at import.
+# Project colors are baked into their KEYMAP entries below.
+LED_ALL_OFF = led_cmd(None, 0, 0, 0)
+LED_TRACKING_ON = led_cmd(0, 0, 255, 0)  # Green tracking LED
+LED_SLEEP_ON = led_cmd(1, 0, 0, 255)  # Blue sleep LED
+LED_SLEEP_OFF = led_cmd(1, 0, 0, 0)
+LED_LAYER_ON = led_cmd(7, 255, 255, 0)  # Yellow layer indicator
+LED_LAYER_OFF = led_cmd(7, 0, 0, 0)
+LED_STOP_ANIM = b"LED:STOP\n"
+# Tracking LED + project LED (2) in one line
+LED_TASK_DEFAULT = led_many_cmd((0, 0, 255, 0), (2, 0, 255, 0))
+LED_TASK_OFF = led_many_cmd((0, 0, 0, 0), (2, 0, 0, 0))
+
+def precompute_led_bytes():
+    """Store the complete LED payload of every project key in its KEYMAP
+    entry as "_led_bytes", so a press sends ready-made bytes"""
+    for layer_map in KEYMAP.values():
+        for cfg in layer_map.values():
+            if cfg.get("action") == "project":
+                color = cfg.get("color", (0, 255, 0))
+                cfg["_led_bytes"] = LED_STOP_ANIM + led_many_cmd((0, 0, 255, 0), (2, *color))
+
+precompute_led_bytes()
 
 def send_led_anim(ser, idx, r, g, b):
     """Start a pulse animation on a specific LED"""
-    ser.write(f"LED:ANIM:{idx}:{r},{g},{b}\n".encode("utf-8"))
+    ser.write(b"LED:ANIM:%d:%d,%d,%d\n" % (idx, r, g, b))
 
 def send_led_stop_anim(ser):
     """Stop any running animation"""
-    ser.write(f"LED:STOP\n".encode("utf-8"))
+    ser.write(LED_STOP_ANIM)
 
 # ----- KEY GRID DISPLAY -----
 def get_key_label(layer, button):
@@ -301,19 +469,26 @@ def get_key_label(layer, button):
         return "Caffeine"
     return "?"
 
-def print_key_grid():
-    """Print a 3x3 grid showing key labels for both layers"""
+# Width of one key cell in the grid
+KEY_GRID_COL_WIDTH = 25
+
+@functools.lru_cache(maxsize=None)
+def render_key_grid():
+    """Render the 3x3 key grid for both layers as one string. KEYMAP labels
+    are final once the config is loaded, so this is only built once."""
     # Button layout in 3x3 grid (buttons 1-9)
     # Row 1: 1, 2, 3
     # Row 2: 4, 5, 6
     # Row 3: 7, 8, 9
 
-    col_width = 25
+    col_width = KEY_GRID_COL_WIDTH
+    lines = []
 
     for layer in [0, 1]:
-        print(f"\n┌{'─' * (col_width * 3 + 4)}┐")
-        print(f"│{f'Layer {layer}':^{col_width * 3 + 4}}│")
-        print(f"├{'─' * col_width}┬{'─' * col_width}┬{'─' * col_width}┤")
+        lines.append("")
+        lines.append(f"┌{'─' * (col_width * 3 + 4)}┐")
+        lines.append(f"│{f'Layer {layer}':^{col_width * 3 + 4}}│")
+        lines.append(f"├{'─' * col_width}┬{'─' * col_width}┬{'─' * col_width}┤")
 
         for row in range(3):
             labels = []
@@ -321,23 +496,82 @@ def print_key_grid():
                 btn = row * 3 + col + 1
                 label = get_key_label(layer, btn)
                 labels.append(f"{label:^{col_width}}")
-            print(f"│{'│'.join(labels)}│")
+            lines.append(f"│{'│'.join(labels)}│")
 
             if row < 2:
-                print(f"├{'─' * col_width}┼{'─' * col_width}┼{'─' * col_width}┤")
+                lines.append(f"├{'─' * col_width}┼{'─' * col_width}┼{'─' * col_width}┤")
+
+        lines.append(f"└{'─' * col_width}┴{'─' * col_width}┴{'─' * col_width}┘")
+
+    return "\n".join(lines) + "\n"
 
-        print(f"└{'─' * col_width}┴{'─' * col_width}┴{'─' * col_width}┘")
+def print_key_grid():
+    """Print a 3x3 grid showing key labels for both layers"""
+    sys.stdout.write(render_key_grid())
 
 # ----- TIME TRACKING LOGIC -----
+# Today's CSV filename and the epoch time at which it stops being valid
+_csv_filename = None
+_csv_filename_expires = 0.0
+
 def get_csv_filename():
     """Get the CSV filename for today's date in format times.YYMMDD.csv"""
-    today = datetime.now()
-    return f"times.{today.strftime('%y%m%d')}.csv"
+    global _csv_filename, _csv_filename_expires
+    # Only rebuilt once the day has rolled over (local midnight)
+    if time.time() >= _csv_filename_expires:
+        today = datetime.now()
+        _csv_filename = f"times.{today.strftime('%y%m%d')}.csv"
+        midnight = today.replace(hour=0, minute=0, second=0, microsecond=0)
+        _csv_filename_expires = (midnight + timedelta(days=1)).timestamp()
+    return _csv_filename
+
+def iso_timestamp():
+    """Current local time as ISO 8601 string with seconds precision"""
+    # Same output as datetime.now().isoformat(timespec='seconds'), without
+    # building a datetime object
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+# First number in a project label, used to sort the summary
+NUM_RE = re.compile(r"\d+")
+
+def project_sort_key(label):
+    """Sort key for the summary: extract number from project name for sorting.
+    sorted() calls it once per label, so it needs no cache."""
+    # Try to extract number from label (e.g., "Projekt 1" -> 1, "Project 10" -> 10)
+    match = NUM_RE.search(label)
+    if match:
+        # Has a number - return (1, number) so numbered projects come after non-numbered
+        return (1, int(match.group()))
+    else:
+        # No number - return (0, label) so non-numbered projects come first
+        return (0, label)
+
+# Rows are buffered in memory and written out in batches: once
+# CSV_FLUSH_ROWS rows are pending or the oldest one is CSV_FLUSH_SECS old,
+# and always on day rollover, show_today and close
+CSV_FLUSH_ROWS = 16
+CSV_FLUSH_SECS = 5.0
+
+# Rows are written as preformatted lines instead of through csv.writer.
+# Only the label can ever need quoting, the timestamp never does.
+CSV_HEADER = "timestamp,label\r\n"
+
+def csv_field(value):
+    """Quote a CSV field the way csv.writer would, if it needs quoting"""
+    value = str(value)  # csv.writer accepted any value, e.g. numeric labels
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
 
 class TimeTracker:
     def __init__(self):
         self.current_task = None
         self.current_csv_file = None
+        # O_APPEND file descriptor for current_csv_file, kept open between events
+        self._fd = None
+        # Rows not written to the file yet, and when the oldest was added
+        self._pending = []
+        self._pending_since = None
         self._ensure_csv_file()
         self._restore_state()
 
@@ -346,11 +580,19 @@ class TimeTracker:
         if not os.path.exists(self.current_csv_file):
             return
 
-        last_label = None
-        with open(self.current_csv_file, newline="") as f:
-            r = csv.DictReader(f)
-            for row in r:
-                last_label = row["label"]
+        # Only the last row matters, so read just the end of the file
+        with open(self.current_csv_file, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - 1024))
+            tail = f.read()
+        lines = tail.splitlines()
+        if len(lines) < 2 and size > len(tail):
+            # Last row longer than the chunk, fall back to the whole file
+            with open(self.current_csv_file, "rb") as f:
+                lines = f.read().splitlines()
+        last_line = lines[-1].decode("utf-8") if lines else ""
+        row = next(csv.reader([last_line]), [])
+        last_label = row[1] if len(row) >= 2 and row != ["timestamp", "label"] else None
 
         # If last entry is not STOP, there's an active task
         if last_label and last_label != "STOP":
@@ -358,44 +600,91 @@ class TimeTracker:
             print(f"[TRACK] Restored active task: {last_label}")
 
     def _ensure_csv_file(self):
-        """Ensure the CSV file for today exists and update current_csv_file"""
+        """Ensure the CSV file for today exists, update current_csv_file and
+        open the append handle for it"""
         self.current_csv_file = get_csv_filename()
-        if not os.path.exists(self.current_csv_file):
-            with open(self.current_csv_file, "w", newline="") as f:
-                w = csv.writer(f)
-                w.writerow(["timestamp", "label"])
+        # Raw fd without Python-side buffering: each row is a single
+        # os.write(), appended atomically by the kernel thanks to O_APPEND
+        self._fd = os.open(self.current_csv_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, CSV_HEADER.encode("utf-8"))
+
+    def _append(self, line):
+        """Queue one complete CSV line for the current file"""
+        # Rows are batched and never fsynced one by one: a hard crash can
+        # lose the rows of the last CSV_FLUSH_SECS at most. checkpoint()
+        # syncs where it matters.
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append(line)
+        if len(self._pending) >= CSV_FLUSH_ROWS:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def flush(self):
+        """Write all pending rows to the file in one call"""
+        if self._pending:
+            os.write(self._fd, "".join(self._pending).encode("utf-8"))
+            self._pending.clear()
+            self._pending_since = None
+
+    def maybe_flush(self):
+        """Flush if the oldest pending row has waited CSV_FLUSH_SECS"""
+        if self._pending and time.monotonic() - self._pending_since >= CSV_FLUSH_SECS:
+            self.flush()
+
+    def flush_timeout(self):
+        """Seconds until pending rows are due (None if nothing is pending),
+        for callers that block waiting for input"""
+        if not self._pending:
+            return None
+        return max(0.0, self._pending_since + CSV_FLUSH_SECS - time.monotonic())
+
+    def checkpoint(self):
+        """Force everything written so far onto disk"""
+        if self._fd is not None:
+            self.flush()
+            os.fsync(self._fd)
 
     def _check_day_change(self):
         """Check if day has changed and switch to new CSV file if needed"""
         new_csv_file = get_csv_filename()
         if new_csv_file != self.current_csv_file:
-            self.current_csv_file = new_csv_file
+            self.close()  # Checkpoints the finished day
             self._ensure_csv_file()
 
+    def close(self):
+        """Checkpoint and close the CSV append handle"""
+        if self._fd is not None:
+            self.checkpoint()
+            os.close(self._fd)
+            self._fd = None
+
     def start_task(self, label):
-        """Write a new task entry immediately to CSV"""
+        """Queue a new task entry for the CSV. It is written with the next
+        flush (after CSV_FLUSH_ROWS rows or CSV_FLUSH_SECS seconds), so a
+        separate --summary run doesn't see it before then."""
         self._check_day_change()
+        timestamp = iso_timestamp()
+        row = f"{timestamp},{csv_field(label)}\r\n"
         self.current_task = label
-        now = datetime.now()
-        with open(self.current_csv_file, "a", newline="") as f:
-            w = csv.writer(f)
-            w.writerow([now.isoformat(timespec='seconds'), label])
-        print(f"[TRACK] started: {label} @ {now.isoformat(timespec='seconds')}")
+        self._append(row)
+        print(f"[TRACK] started: {label} @ {timestamp}")
 
     def stop_task(self):
         """Write a STOP entry to mark end of tracking"""
         if self.current_task is None:
             return
         self._check_day_change()
-        now = datetime.now()
-        with open(self.current_csv_file, "a", newline="") as f:
-            w = csv.writer(f)
-            w.writerow([now.isoformat(timespec='seconds'), "STOP"])
-        print(f"[TRACK] stopped @ {now.isoformat(timespec='seconds')}")
+        timestamp = iso_timestamp()
+        self._append(f"{timestamp},STOP\r\n")
+        print(f"[TRACK] stopped @ {timestamp}")
         self.current_task = None
 
     def show_today(self):
         """Show time tracking summary for all available days, sorted by date"""
+        self.checkpoint()
         # Find all times.*.csv files
         csv_files = sorted(glob.glob("times.*.csv"))
 
@@ -415,18 +704,6 @@ class TimeTracker:
                 return f"{hours}h {mins}m {secs}s"
             return f"{mins}m {secs}s"
 
-        # Sort function: extract number from project name for sorting
-        def project_sort_key(item):
-            label = item[0]
-            # Try to extract number from label (e.g., "Projekt 1" -> 1, "Project 10" -> 10)
-            match = re.search(r'\d+', label)
-            if match:
-                # Has a number - return (1, number) so numbered projects come after non-numbered
-                return (1, int(match.group()))
-            else:
-                # No number - return (0, label) so non-numbered projects come first
-                return (0, label)
-
         # Extract date from filename and sort
         def extract_date(filename):
             # times.YYMMDD.csv -> YYMMDD
@@ -447,51 +724,48 @@ class TimeTracker:
             else:
                 display_date = csv_file
 
-            raw_entries = []
+            # Single pass over the rows: each entry lasts until the next row,
+            # so only the previous row has to be kept around
+            entries = []
+            per_label = defaultdict(int)
+            prev_start = None
+            prev_label = None
 
-            # Read all entries
+            # Columns: timestamp, label
             with open(csv_file, newline="") as f:
-                r = csv.DictReader(f)
+                r = csv.reader(f)
+                next(r, None)  # Skip header
                 for row in r:
-                    ts = datetime.fromisoformat(row["timestamp"])
-                    raw_entries.append({
-                        "timestamp": ts,
-                        "label": row["label"]
-                    })
-
-            if not raw_entries:
-                continue
-
-            # Calculate durations: each entry lasts until the next one
-            entries = []
-            per_label = {}
-            today = datetime.now().date()
-
-            for i, entry in enumerate(raw_entries):
-                label = entry["label"]
-                if label == "STOP":
-                    continue  # STOP entries are just markers, not tasks
-
-                start = entry["timestamp"]
-                # End time is the next entry's timestamp, or now if it's the last entry
-                if i + 1 < len(raw_entries):
-                    end = raw_entries[i + 1]["timestamp"]
-                else:
-                    # Only use "now" if this is today's file
-                    if start.date() == today:
-                        end = datetime.now()  # Currently running task
-                    else:
-                        continue  # Skip incomplete entries from past days
-
-                dur = int((end - start).total_seconds())
+                    if len(row) < 2:
+                        continue
+                    timestamp = datetime.fromisoformat(row[0])
+                    # STOP entries are just markers, not tasks
+                    if prev_label is not None and prev_label != "STOP":
+                        dur = int((timestamp - prev_start).total_seconds())
+                        entries.append({
+                            "start": prev_start,
+                            "end": timestamp,
+                            "label": prev_label,
+                            "duration": dur,
+                            "is_running": False
+                        })
+                        per_label[prev_label] += dur
+                    prev_start = timestamp
+                    prev_label = row[1]
+
+            # The last entry runs until now, but only in today's file;
+            # incomplete entries from past days are skipped
+            now = datetime.now()
+            if prev_label is not None and prev_label != "STOP" and prev_start.date() == now.date():
+                dur = int((now - prev_start).total_seconds())
                 entries.append({
-                    "start": start,
-                    "end": end,
-                    "label": label,
+                    "start": prev_start,
+                    "end": now,
+                    "label": prev_label,
                     "duration": dur,
-                    "is_running": i + 1 >= len(raw_entries) and start.date() == today
+                    "is_running": True
                 })
-                per_label[label] = per_label.get(label, 0) + dur
+                per_label[prev_label] += dur
 
             if not entries:
                 continue
@@ -510,7 +784,7 @@ class TimeTracker:
             # Second list: Summary by project
             print(f"---- {display_date} - SUMMARY BY PROJECT ----")
             total_secs = 0
-            for label, secs in sorted(per_label.items(), key=project_sort_key):
+            for label, secs in sorted(per_label.items(), key=lambda item: project_sort_key(item[0])):
                 dur_str = format_duration(secs)
                 total_secs += secs
                 print(f"{label:20s} | {dur_str:>8s}")
@@ -520,11 +794,27 @@ class TimeTracker:
         # Print key grid at the end
         print_key_grid()
 
-def safe_send(ser, data):
-    """Safely send data to serial port, returns False if disconnected"""
+# Not available on Windows, where pyserial has no file descriptor either
+HAVE_WRITEV = hasattr(os, "writev")
+
+def safe_send(ser, *chunks):
+    """Safely send (encoded) commands to serial port in a single write,
+    returns False if disconnected"""
+    # No flush(): on POSIX write() already hands the bytes to the kernel,
+    # flush() would only block in tcdrain() until they are on the wire
     try:
-        ser.write(data.encode("utf-8"))
-        ser.flush()
+        if HAVE_WRITEV:
+            # Let the kernel gather the chunks, no joined copy needed.
+            # pyserial's fd is non-blocking, so if the kernel buffer is full
+            # the rest goes through ser.write(), which waits for room.
+            try:
+                written = os.writev(ser.fileno(), chunks)
+            except BlockingIOError:
+                written = 0
+            if written < sum(map(len, chunks)):
+                ser.write(b"".join(chunks)[written:])
+        else:
+            ser.write(b"".join(chunks))
         return True
     except (SerialException, OSError):
         return False
@@ -541,11 +831,30 @@ def get_all_projects():
                     projects.append(label)
     return projects
 
+# ----- PREVENT SLEEP -----
+CAFFEINATE_PATH = shutil.which("caffeinate")
+
+def start_caffeinate():
+    """Start caffeinate to keep the Mac awake, returns its pid (or None)"""
+    if CAFFEINATE_PATH is None:
+        print("[WARN] caffeinate not found, can't prevent sleep")
+        return None
+    # posix_spawn starts it directly, without forking this process first
+    return os.posix_spawn(CAFFEINATE_PATH, ["caffeinate", "-dimsu"], os.environ)
+
+def stop_caffeinate(pid):
+    """Terminate a caffeinate process started by start_caffeinate"""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass  # Already gone
+
 def menu_mode():
     """Run time tracker in interactive terminal menu mode (no Pico required)"""
     tracker = TimeTracker()
     prevent_sleep = False
-    caffeinate_proc = None
+    caffeinate_pid = None
     projects = get_all_projects()
 
     print("\n=== Time Tracker (Menu Mode) ===\n")
@@ -570,6 +879,8 @@ def menu_mode():
             print(f"  [q] Quit")
             print()
 
+            # Nothing happens while waiting for input, so write rows out now
+            tracker.flush()
             try:
                 choice = input("  > ").strip().lower()
             except EOFError:
@@ -580,14 +891,16 @@ def menu_mode():
             elif choice == "s":
                 tracker.show_today()
             elif choice == "c":
-                prevent_sleep = not prevent_sleep
-                if prevent_sleep:
-                    caffeinate_proc = subprocess.Popen(["caffeinate", "-dimsu"])
-                    print("[SLEEP] Prevent sleep enabled")
+                if not prevent_sleep:
+                    caffeinate_pid = start_caffeinate()
+                    if caffeinate_pid is not None:
+                        prevent_sleep = True
+                        print("[SLEEP] Prevent sleep enabled")
                 else:
-                    if caffeinate_proc is not None:
-                        caffeinate_proc.terminate()
-                        caffeinate_proc = None
+                    prevent_sleep = False
+                    if caffeinate_pid is not None:
+                        stop_caffeinate(caffeinate_pid)
+                        caffeinate_pid = None
                     print("[SLEEP] Prevent sleep disabled")
             elif choice == "0":
                 if tracker.current_task:
@@ -608,15 +921,87 @@ def menu_mode():
 
     # Cleanup
     tracker.stop_task()
-    if caffeinate_proc is not None:
-        caffeinate_proc.terminate()
+    tracker.close()
+    if caffeinate_pid is not None:
+        stop_caffeinate(caffeinate_pid)
     print("[INFO] Goodbye!")
 
+# ----- KEYPAD ACTION HANDLERS -----
+class KeypadSession:
+    """State of a keypad session that the action handlers work on"""
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.ser = None
+        self.layer = 0  # Start with layer 0 (default)
+        self.prevent_sleep = False
+        self.caffeinate_pid = None
+
+def handle_prevent_sleep(session, config):
+    if not session.prevent_sleep:
+        session.caffeinate_pid = start_caffeinate()
+        if session.caffeinate_pid is None:
+            return  # Stay off, start_caffeinate() already warned
+        session.prevent_sleep = True
+        print("[SLEEP] Active (caffeinate running)")
+        safe_send(session.ser, LED_SLEEP_ON)
+    else:
+        session.prevent_sleep = False
+        print("[SLEEP] Inactive")
+        if session.caffeinate_pid is not None:
+            stop_caffeinate(session.caffeinate_pid)
+            session.caffeinate_pid = None
+        safe_send(session.ser, LED_SLEEP_OFF)
+
+def handle_tracking_toggle(session, config):
+    tracker = session.tracker
+    if tracker.current_task:
+        tracker.stop_task()
+        safe_send(session.ser, LED_STOP_ANIM, LED_TASK_OFF)
+    else:
+        tracker.start_task("Allgemein")
+        safe_send(session.ser, LED_TASK_DEFAULT)
+
+def handle_project(session, config):
+    label = config.get("label", "Unknown Project")
+    color = config.get("color", (0, 255, 0))
+    session.tracker.start_task(label)
+    safe_send(session.ser, config["_led_bytes"])
+    print(f"[PROJECT] Started {label} with color {color}")
+
+def handle_show_today(session, config):
+    session.tracker.show_today()
+
+def handle_layer_shift(session, config):
+    session.layer = 1 if session.layer == 0 else 0
+    print(f"[LAYER] Switched to layer {session.layer}")
+    if session.layer == 1:
+        safe_send(session.ser, LED_LAYER_ON)
+    else:
+        safe_send(session.ser, LED_LAYER_OFF)
+
+# KEYMAP action -> handler(session, config)
+ACTION_HANDLERS = {
+    "prevent_sleep": handle_prevent_sleep,
+    "tracking_toggle": handle_tracking_toggle,
+    "project": handle_project,
+    "show_today": handle_show_today,
+    "layer_shift": handle_layer_shift,
+}
+
+# (layer, button) -> (handler, config), so an event is a single dict lookup.
+# The config dicts are shared with KEYMAP.
+KEYMAP_FLAT = {
+    (layer, button): (ACTION_HANDLERS.get(config.get("action")), config)
+    for layer, layer_map in KEYMAP.items()
+    for button, config in layer_map.items()
+}
+
 def main():
     # Check for --summary flag
     if len(sys.argv) > 1 and sys.argv[1] in ("--summary", "-s"):
         tracker = TimeTracker()
         tracker.show_today()
+        tracker.close()
         return
 
     # Check for --no-pico flag (menu mode)
@@ -631,12 +1016,15 @@ def main():
     port_filter = os.environ.get("PICO_PORT_FILTER")
 
     tracker = TimeTracker()
-    prevent_sleep = False
-    caffeinate_proc = None
-    layer = 0  # Start with layer 0 (default)
-    ser = None
+    session = KeypadSession(tracker)
+    rx_buf = bytearray()  # Received bytes not yet split into lines
+    # Waits for keypad input; the port's fd is registered while connected
+    sel = selectors.DefaultSelector()
     reconnect_delay = 2.0  # seconds between reconnection attempts
     user_requested_exit = False
+    # Only a regular exit stops the running task. After a crash it stays
+    # open in the CSV, so _restore_state() picks it up again on restart.
+    stop_on_exit = False
 
     print_key_grid()
     print("\n[INFO] Hold Layer button for 5 seconds to gracefully unmount keypad")
@@ -644,47 +1032,80 @@ def main():
     try:
         while not user_requested_exit:
             # Connection loop - try to connect/reconnect
-            if ser is None:
+            if session.ser is None:
+                ser = None
+                fd = None
                 try:
                     port = find_pico_port(port_filter)
                     print(f"[INFO] Connecting to {port}")
-                    ser = serial.Serial(port, 115200, timeout=0.1)
-                    time.sleep(0.5)
+                    ser = serial.Serial(port, 115200, timeout=0.5)
+                    set_low_latency(ser)
                     ser.reset_input_buffer()
-                    ser.reset_output_buffer()
+                    # Events are read straight from the fd, see below
+                    sel.register(ser.fileno(), selectors.EVENT_READ)
+                    fd = ser.fileno()
+                    # Ready as soon as the keypad answers, no fixed settle delay
+                    if not handshake(ser):
+                        print("[WARN] No PONG from keypad, continuing anyway")
+                    rx_buf.clear()
+                    session.ser = ser
                     print("[INFO] Connection established, waiting for events...")
 
                     # Clear LEDs and restore state on reconnect
-                    safe_send(ser, "LED:ALL:0,0,0\n")
+                    cmds = [LED_ALL_OFF]
 
                     # Restore LED state based on current tracking
                     if tracker.current_task:
-                        safe_send(ser, "LED:0:0,255,0\n")  # Green tracking LED
-                    if layer == 1:
-                        safe_send(ser, "LED:7:255,255,0\n")  # Yellow layer indicator
-                    if prevent_sleep:
-                        safe_send(ser, "LED:1:0,0,255\n")  # Blue sleep LED
-
-                except RuntimeError as e:
+                        cmds.append(LED_TRACKING_ON)
+                    if session.layer == 1:
+                        cmds.append(LED_LAYER_ON)
+                    if session.prevent_sleep:
+                        cmds.append(LED_SLEEP_ON)
+                    safe_send(ser, *cmds)
+
+                except (RuntimeError, SerialException, OSError) as e:
+                    # Includes the port vanishing mid-handshake
                     print(f"[WARN] {e}")
-                    print(f"[INFO] Retrying in {reconnect_delay} seconds...")
-                    time.sleep(reconnect_delay)
+                    print(f"[INFO] Retrying when the keypad shows up (at most {reconnect_delay} seconds)...")
+                    if fd is not None:
+                        sel.unregister(fd)
+                    if ser is not None:
+                        try:
+                            ser.close()
+                        except:
+                            pass
+                    tracker.flush()  # Don't hold rows while disconnected
+                    wait_for_port(reconnect_delay)
                     continue
 
             # Main event loop
+            ser = session.ser
             try:
-                line = ser.readline()
-                if not line:
-                    time.sleep(0.01)
+                # Take the next complete line from the buffer. Only read from
+                # the port when none is left: block in the selector until the
+                # kernel has data (Ctrl+C still interrupts the wait), then
+                # drain everything waiting in one call. The wait ends early
+                # when buffered CSV rows are due to be written.
+                nl = rx_buf.find(b"\n")
+                if nl == -1:
+                    if not sel.select(tracker.flush_timeout()):
+                        tracker.maybe_flush()
+                        continue
+                    chunk = os.read(fd, 4096)
+                    if not chunk:
+                        # Readable but empty means the device went away
+                        raise SerialException("device reports readiness to read but returned no data")
+                    rx_buf += chunk
                     continue
+                line = bytes(rx_buf[:nl])  # Parsed as bytes, no decoding needed
+                del rx_buf[:nl + 1]
 
-                line = line.decode("utf-8", errors="ignore").strip()
-                if not line.startswith("BTN:"):
+                match = BTN_RE.match(line)
+                if match is None:
                     continue
 
-                parts = line.split(":")
-                btn_num = int(parts[1])
-                is_long_press = len(parts) > 2 and parts[2] == "LONG"
+                btn_num = int(match.group(1))
+                is_long_press = match.group(2) is not None
 
                 # Handle long-press on layer_shift button (button 9) for graceful unmount
                 if btn_num == 9 and is_long_press:
@@ -697,84 +1118,50 @@ def main():
                     continue
 
                 # Look up action in the current layer
-                layer_map = KEYMAP.get(layer, {})
-                config = layer_map.get(btn_num, None)
+                entry = KEYMAP_FLAT.get((session.layer, btn_num))
 
-                if config is None:
-                    print(f"[EVENT] Button {btn_num} → no mapping in layer {layer}")
+                if entry is None:
+                    print(f"[EVENT] Button {btn_num} -> no mapping in layer {session.layer}")
                     continue
 
-                action = config.get("action")
-                if action == "prevent_sleep":
-                    prevent_sleep = not prevent_sleep
-                    if prevent_sleep:
-                        print("[SLEEP] Active (please in real: subprocess caffeinate)")
-                        caffeinate_proc = subprocess.Popen(["caffeinate", "-dimsu"])
-                        safe_send(ser, "LED:1:0,0,255\n")
-                    else:
-                        print("[SLEEP] Inactive")
-                        if caffeinate_proc is not None:
-                            caffeinate_proc.terminate()
-                            caffeinate_proc = None
-                        safe_send(ser, "LED:1:0,0,0\n")
-
-                elif action == "tracking_toggle":
-                    if tracker.current_task:
-                        tracker.stop_task()
-                        safe_send(ser, "LED:STOP\n")
-                        safe_send(ser, "LED:0:0,0,0\n")
-                        safe_send(ser, "LED:2:0,0,0\n")
-                    else:
-                        tracker.start_task("Allgemein")
-                        safe_send(ser, "LED:0:0,255,0\n")
-                        safe_send(ser, "LED:2:0,255,0\n")
-
-                elif action == "project":
-                    label = config.get("label", "Unknown Project")
-                    color = config.get("color", (0, 255, 0))
-                    tracker.start_task(label)
-                    safe_send(ser, "LED:STOP\n")
-                    safe_send(ser, "LED:0:0,255,0\n")
-                    safe_send(ser, f"LED:2:{color[0]},{color[1]},{color[2]}\n")
-                    print(f"[PROJECT] Started {label} with color {color}")
-
-                elif action == "show_today":
-                    tracker.show_today()
-
-                elif action == "layer_shift":
-                    layer = 1 if layer == 0 else 0
-                    print(f"[LAYER] Switched to layer {layer}")
-                    if layer == 1:
-                        safe_send(ser, "LED:7:255,255,0\n")
-                    else:
-                        safe_send(ser, "LED:7:0,0,0\n")
+                handler, config = entry
+                if handler is not None:
+                    handler(session, config)
 
             except (SerialException, OSError) as e:
                 print(f"\n[WARN] Connection lost: {e}")
-                print(f"[INFO] Attempting to reconnect in {reconnect_delay} seconds...")
+                print(f"[INFO] Attempting to reconnect (within {reconnect_delay} seconds)...")
+                sel.unregister(fd)
                 try:
                     ser.close()
                 except:
                     pass
-                ser = None
-                time.sleep(reconnect_delay)
+                session.ser = None
+                tracker.flush()  # Don't hold rows while disconnected
+                wait_for_port(reconnect_delay)
+        stop_on_exit = True
 
     except KeyboardInterrupt:
         print("\n[INFO] Keyboard interrupt received...")
-
-    # Cleanup
-    print("[INFO] Exiting, stopping any running task...")
-    tracker.stop_task()
-    if ser is not None:
-        try:
-            safe_send(ser, "LED:STOP\n")
-            safe_send(ser, "LED:ALL:0,0,0\n")
-            ser.close()
-        except:
-            pass
-    if caffeinate_proc is not None:
-        caffeinate_proc.terminate()
-    print("[INFO] Goodbye!")
+        stop_on_exit = True
+
+    finally:
+        # Cleanup, also on unexpected errors so buffered rows are written
+        if stop_on_exit:
+            print("[INFO] Exiting, stopping any running task...")
+            tracker.stop_task()
+        tracker.close()
+        if session.ser is not None:
+            try:
+                safe_send(session.ser, LED_STOP_ANIM, LED_ALL_OFF)
+                session.ser.flush()  # Let the LEDs turn off before the port closes
+                session.ser.close()
+            except:
+                pass
+        sel.close()
+        if session.caffeinate_pid is not None:
+            stop_caffeinate(session.caffeinate_pid)
+        print("[INFO] Goodbye!")
 
 if __name__ == "__main__":
     main()